@@ -5,37 +5,51 @@
 # Author: Freddie Sherratt
 # ------------------------------------------------------------------------------
 
+import logging
+import random
 import threading
 import time
-import traceback
-import sys
+
+import serial
 
 from mavlinkThread import mavSerial, mavThread
 import pymavlink.dialects.v20.ardupilotmega as pymavlink
 
 # Print out all incoming message
 class mavClass( mavThread.mavThread ):
+    # Backoff doubles per failed attempt up to this many seconds
+    maxBackoffTime = 30
+
     def _processReadMsg( self, msgList ):
         for msg in msgList:
             print( msg )
 
     def loop( self ):
+        attempts = 0
+
         while not self._intentionallyExit:
             try:
                 super( mavClass, self).loop()
-            except:
-                traceback.print_exc(file=sys.stdout)
-                self.restartConnection()
+                attempts = 0
 
-    def restartConnection(self):
-        time.sleep(1)
+            except Exception:
+                logging.warning( 'MAVLink connection lost, retrying', exc_info = True )
+
+                attempts += 1
+                self.restartConnection( attempts )
+
+    def restartConnection(self, attempts = 1):
+        # Exponential backoff with jitter so a broken device is not hammered
+        # at a fixed rate and simultaneous clients don't retry in lockstep
+        backoff = min( self.maxBackoffTime, 2 ** attempts )
+        time.sleep( backoff * ( 0.5 + random.random() ) )
 
         try:
             self._ser.closePort()
             self._ser.openPort()
-            self.startLoop()
-        except:
-            traceback.print_exc(file=sys.stdout)        
+
+        except ( serial.SerialException, OSError ):
+            logging.warning( 'MAVLink reconnect failed', exc_info = True )
 
 
 if __name__ == "__main__":
@@ -1,9 +1,13 @@
 import abc
+import time
 
 # ------------------------------------------------------------------------------
 # commAbstract
 # Interface class for communication methods that are called by a object
-# inheriting from the MAVAbstract object
+# inheriting from the MAVAbstract object. The batching, pooling and event
+# methods have working fallbacks built on the original read/write interface,
+# so a comm implementation written against that interface keeps working -
+# override them where the transport can do better
 # ------------------------------------------------------------------------------
 
 class commAbstract:
@@ -35,4 +39,36 @@ class commAbstract:
 
     @abc.abstractmethod
     def flush( self ):
-        pass
\ No newline at end of file
+        pass
+
+    def readAll( self ):
+        return self.read()
+
+    def read_into_pooled( self ):
+        return self.readAll()
+
+    def read_batch( self, maxMsgs = 32 ):
+        b = self.read_into_pooled()
+
+        if b:
+            return [ b ]
+
+        return []
+
+    def release( self, view ):
+        pass
+
+    def writeBatch( self, bufs ):
+        for b in bufs:
+            self.write( b )
+
+    def wait_readable( self, timeout = None ):
+        # No event mechanism on the base interface, a bounded sleep at least
+        # stops callers from spinning
+        if timeout is not None:
+            time.sleep( timeout )
+
+        return False
+
+    def fileno( self ):
+        raise OSError( 'Transport does not expose a file descriptor' )
@@ -6,13 +6,21 @@
 # Author: Freddie Sherratt
 # ------------------------------------------------------------------------------
 
+import collections
+import contextlib
+import logging
+import selectors
 import threading
+import time
 import serial
-import traceback
-import sys
 
 from .commAbstract import commAbstract
 
+# Silent unless the application configures logging, errors are also tallied
+# in errCounters so hot paths never pay for formatted I/O
+_log = logging.getLogger( __name__ )
+_log.addHandler( logging.NullHandler() )
+
 class mavSerial( commAbstract ):
     # --------------------------------------------------------------------------
     # Public function definitions
@@ -26,9 +34,12 @@ class mavSerial( commAbstract ):
     # param baudrate - serial baudrate
     # param timeout - serial read timeout
     # param writeTimeout - serial write timeout
+    # param thread_safe - guard read/write with locks. Only required if multiple
+    # threads read or write concurrently, the usual single reader/single writer
+    # mavThread topology does not need it
     # return void
     # --------------------------------------------------------------------------
-    def __init__( self, serialPortAddress ):
+    def __init__( self, serialPortAddress, thread_safe = False ):
         self._serialObj = serial.Serial()
 
         self._serialObj.port = serialPortAddress[0]
@@ -36,8 +47,18 @@ class mavSerial( commAbstract ):
         self._serialObj.timeout = 0.01
         self._serialObj.write_timeout = 3
 
-        self._writeLock = threading.Lock()
-        self._readLock = threading.Lock()
+        if thread_safe:
+            self._writeLock = threading.Lock()
+            self._readLock = threading.Lock()
+        else:
+            self._writeLock = contextlib.nullcontext()
+            self._readLock = contextlib.nullcontext()
+
+        self._selector = None
+
+        # Tally of swallowed errors per operation, inspect this rather than
+        # expecting tracebacks on stdout
+        self.errCounters = collections.Counter()
 
     # --------------------------------------------------------------------------
     # openPort
@@ -59,12 +80,17 @@ class mavSerial( commAbstract ):
     # return void
     # --------------------------------------------------------------------------
     def closePort( self ):
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
         try:
-            if self._serialObj.isOpen:
+            if self._serialObj.is_open:
                 self._serialObj.close()
 
         except serial.SerialException:
-            traceback.print_exc(file=sys.stdout)
+            self.errCounters['close'] += 1
+            _log.warning( 'Serial close failed', exc_info = True )
 
     # --------------------------------------------------------------------------
     # read
@@ -73,20 +99,55 @@ class mavSerial( commAbstract ):
     # return raises an Exception if there is an error
     # --------------------------------------------------------------------------
     def read( self, numBytes = 1 ):
-        self._readLock.acquire()
+        with self._readLock:
+            try:
+                b = self._serialObj.read( numBytes )
 
-        try:
-            b = self._serialObj.read( numBytes )
-        
-        except serial.SerialTimeoutException:
-            b = ''
+            except serial.SerialTimeoutException:
+                # A timeout on an idle link is expected, return the same empty
+                # bytes the success path gives so the parser stays on its
+                # bytes fast path
+                b = b''
 
-            traceback.print_exc(file=sys.stdout)
+        return b
 
-        finally:
-            self._readLock.release()
+    # --------------------------------------------------------------------------
+    # readAll
+    # Drain the serial FIFO in a single read rather than byte at a time. Far
+    # cheaper than read(1) loops when feeding a mavlink parser
+    # param null
+    # return byte string of waiting data, b'' if none arrives within timeout
+    # --------------------------------------------------------------------------
+    def readAll( self ):
+        return self.read( max( 1, self._serialObj.in_waiting ) )
 
-        return b
+    # --------------------------------------------------------------------------
+    # read_into_pooled
+    # pyserial already hands back a fresh bytes object so there is no pooled
+    # buffer to manage, this is an alias for readAll with a no-op release
+    # param null
+    # return byte string of waiting data, b'' if none arrives within timeout
+    # --------------------------------------------------------------------------
+    def read_into_pooled( self ):
+        return self.readAll()
+
+    def release( self, view ):
+        pass
+
+    # --------------------------------------------------------------------------
+    # read_batch
+    # readAll already drains the FIFO in one read so a batch is at most one
+    # buffer here
+    # param maxMsgs - unused, kept for interface compatibility
+    # return list containing the drained bytes, empty if nothing is waiting
+    # --------------------------------------------------------------------------
+    def read_batch( self, maxMsgs = 32 ):
+        b = self.readAll()
+
+        if b:
+            return [ b ]
+
+        return []
 
     # --------------------------------------------------------------------------
     # write
@@ -95,16 +156,25 @@ class mavSerial( commAbstract ):
     # return raises an Exception if there is an error
     # --------------------------------------------------------------------------
     def write( self, b ):
-        self._writeLock.acquire()
+        with self._writeLock:
+            try:
+                self._serialObj.write( b )
 
-        try:
-            self._serialObj.write( b )
+            except serial.SerialTimeoutException:
+                self.errCounters['write'] += 1
 
-        except serial.SerialTimeoutException:
-            traceback.print_exc(file=sys.stdout)
+                if _log.isEnabledFor( logging.DEBUG ):
+                    _log.debug( 'Serial write timeout', exc_info = True )
 
-        finally:
-            self._writeLock.release()
+    # --------------------------------------------------------------------------
+    # writeBatch
+    # Write several byte buffers in a single serial write, one syscall for the
+    # whole batch instead of one per message
+    # param bufs - list of byte buffers to write
+    # return void
+    # --------------------------------------------------------------------------
+    def writeBatch( self, bufs ):
+        self.write( b''.join( bufs ) )
 
     # --------------------------------------------------------------------------
     # isOpen
@@ -114,7 +184,7 @@ class mavSerial( commAbstract ):
     # --------------------------------------------------------------------------
     def isOpen( self ):
         try:
-            return self._serialObj.isOpen()
+            return self._serialObj.is_open
 
         except serial.SerialException:
             return False
@@ -126,10 +196,39 @@ class mavSerial( commAbstract ):
     # return True if data available to read, False otherwise
     # --------------------------------------------------------------------------
     def dataAvailable( self ):
-        if self._serialObj.inWaiting() > 0:
-            return True
+        return self._serialObj.in_waiting > 0
 
-        return False
+    # --------------------------------------------------------------------------
+    # fileno
+    # Expose the underlying file descriptor so the port can be registered
+    # with an external event loop, e.g. asyncio loop.add_reader
+    # param null
+    # return file descriptor number, raises if the port is not open
+    # --------------------------------------------------------------------------
+    def fileno( self ):
+        return self._serialObj.fileno()
+
+    # --------------------------------------------------------------------------
+    # wait_readable
+    # Block until data is waiting on the serial port or the timeout expires.
+    # Cheaper than sleep polling - the thread wakes as soon as bytes arrive
+    # param timeout - maximum time to wait in seconds, None waits forever
+    # return True if data is available to read, False on timeout
+    # --------------------------------------------------------------------------
+    def wait_readable( self, timeout = None ):
+        try:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+                self._selector.register( self._serialObj.fileno(), selectors.EVENT_READ )
+
+            return bool( self._selector.select( timeout ) )
+
+        except( OSError, ValueError ):
+            # Port not open - fall back to a plain sleep so callers don't spin
+            if timeout is not None:
+                time.sleep( timeout )
+
+            return False
 
     # --------------------------------------------------------------------------
     # flush
@@ -138,7 +237,7 @@ class mavSerial( commAbstract ):
     # return void
     # --------------------------------------------------------------------------
     def flush( self ):
-        self._serialObj.flushInput()
-        self._serialObj.flushOutput()
+        self._serialObj.reset_input_buffer()
+        self._serialObj.reset_output_buffer()
 
 # ------------------------------------ EOF -------------------------------------
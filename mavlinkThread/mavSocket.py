@@ -1,31 +1,89 @@
 # ------------------------------------------------------------------------------
-# serial.py
-# Abstraction of socket port communication for use with a mavThreadAbstract 
-# object
+# mavSocket.py
+# Abstraction of socket communication for use with a mavThreadAbstract object.
+# Addresses are handled as follows: a listen address binds the read socket, a
+# broadcast address connects the write socket, and whichever is missing is
+# discovered from traffic - the write address from the first received datagram,
+# the read address from the write socket's own name after connect
 #
 # Author: Freddie Sherratt
 # ------------------------------------------------------------------------------
 
+import collections
+import contextlib
+import logging
 import threading
 import socket
-import traceback
 from .commAbstract import commAbstract
 import select
+import struct
 import time
-import sys
 import warnings
 import os
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, set_close_on_exec becomes a no-op
+    fcntl = None
+
+# Silent unless the application configures logging, errors are also tallied
+# in errCounters so hot paths never pay for formatted I/O
+_log = logging.getLogger( __name__ )
+_log.addHandler( logging.NullHandler() )
+
+# On Linux the socket can be created non-blocking and close-on-exec in the
+# socket(2) call itself, saving the follow-up fcntl syscalls. Zero elsewhere
+_sockTypeFlags = getattr( socket, 'SOCK_NONBLOCK', 0 ) | getattr( socket, 'SOCK_CLOEXEC', 0 )
+
+# Hostname lookups resolved so far, shared across instances so the
+# auto-recovery path does not repeat a potentially blocking DNS query on
+# every reconnect
+_addrCache = {}
+
+# ------------------------------------------------------------------------------
+# _resolveAddress
+# Resolve the host part of an AF_INET address tuple to a dotted-quad once per
+# process. Already-numeric hosts are passed straight through
+# param address - (host, port) tuple, may be None
+# param afType - socket address family the tuple is for
+# return address tuple with the host resolved where possible
+# ------------------------------------------------------------------------------
+def _resolveAddress( address, afType ):
+    if address is None or afType != socket.AF_INET:
+        return address
+
+    host = address[0]
+
+    try:
+        socket.inet_aton( host )
+        return address
+
+    except OSError:
+        pass
+
+    try:
+        host = _addrCache.setdefault( host, socket.gethostbyname( host ) )
+
+    except OSError:
+        # Leave unresolved, bind/connect will raise something meaningful
+        pass
+
+    return ( host, address[1] )
+
 class mavSocket( commAbstract ):
     # --------------------------------------------------------------------------
     # __init__
     # initialise serialClass object, does not start the serial port. Call
     # openPort once object is initialised to start serial communication.
-    # param listenAddress - listen address 
+    # param listenAddress - listen address
     # param broadcastAddress - broadcast address
+    # param thread_safe - guard read/write with locks. Only required if multiple
+    # threads read or write concurrently, datagram send/recv are already atomic
+    # in the kernel for a single reader/single writer
     # return void
     # --------------------------------------------------------------------------
-    def __init__( self, listenAddress = None, broadcastAddress = None ):
+    def __init__( self, listenAddress = None, broadcastAddress = None, thread_safe = False ):
         self._sRead = None
         self._sWrite = None
 
@@ -34,18 +92,60 @@ class mavSocket( commAbstract ):
         self.SOCK_type = socket.SOCK_DGRAM
         self.enable_broadcast = True
 
+        # Kernel socket buffer sizes requested at openPort, the defaults are
+        # too small for bursty telemetry and drops there are silent. Change
+        # before calling openPort if a different size is needed
+        self.rcvBuffSize = self.buffSize
+        self.sndBuffSize = self.buffSize
+
+        # Opt in to SO_REUSEPORT before openPort to let several processes
+        # share one listen address. Off by default - with it on, a second
+        # process binding the same telemetry port load-balances the stream
+        # instead of failing with EADDRINUSE
+        self.reusePort = False
+
+        # Receive buffer is allocated once and reused for every datagram to
+        # avoid a fresh buffSize allocation per read
+        self._rxBuf = bytearray( self.buffSize )
+        self._rxView = memoryview( self._rxBuf )
+
+        # Upper bound on datagrams discarded per flush call
+        self._maxFlushPackets = 1024
+
+        # Stream mode only: abort the connection on closePort instead of a
+        # graceful shutdown. The RST skips the 60 s TIME_WAIT hold on the
+        # port, useful in test harnesses that churn through connections
+        self.abortOnClose = False
+
+        # Freelist of receive buffers for read_into_pooled, grown on demand
+        # and capped so a burst cannot pin memory forever
+        self._recvPool = collections.deque()
+        self._recvPoolCap = 8
+
+        # Tally of swallowed errors per operation, inspect this rather than
+        # expecting tracebacks on stdout
+        self.errCounters = collections.Counter()
+
         if listenAddress is None and broadcastAddress is None:
             raise Exception('A address for either listen, broadcast or both is required')
 
         self._readAddress = listenAddress
         self._writeAddress = broadcastAddress
 
-        self._writeLock = threading.Lock()
-        self._readLock = threading.Lock()
+        if thread_safe:
+            self._writeLock = threading.Lock()
+            self._readLock = threading.Lock()
+        else:
+            self._writeLock = contextlib.nullcontext()
+            self._readLock = contextlib.nullcontext()
 
         self._rConnected = False
         self._wConnected = False
 
+        # Set when the read address was discovered from our own write
+        # socket, whose port the read socket then intentionally shares
+        self._sharedReadAddr = False
+
     # --------------------------------------------------------------------------
     # set_INET_type
     # Change from default AF type
@@ -103,16 +203,34 @@ class mavSocket( commAbstract ):
             warnings.warn('Read address not specified - message discarded', UserWarning, stacklevel=3)
             return False
 
-        self._sRead = socket.socket( self.AF_type, self.SOCK_type, )
+        self._sRead = socket.socket( self.AF_type, self.SOCK_type | _sockTypeFlags )
+
+        # SO_REUSEADDR frees a stream port stuck in TIME_WAIT for immediate
+        # rebinding. Deliberately not set for plain datagram sockets - on
+        # UDP it lets a second process bind the same telemetry port and
+        # silently take part of the stream instead of failing EADDRINUSE
+        if self.SOCK_type == socket.SOCK_STREAM or self.reusePort \
+            or self._sharedReadAddr:
+            self._sRead.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+
+        # SO_REUSEPORT lets several processes bind the same address for
+        # parallel receive where the platform supports it, IP sockets only
+        if self.reusePort and hasattr( socket, 'SO_REUSEPORT' ) \
+            and self.AF_type != socket.AF_UNIX:
+            self._sRead.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEPORT, 1 )
 
-        self._sRead.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
-        self._sRead.setblocking(0)
+        self._setBuffSize( self._sRead, socket.SO_RCVBUF, self.rcvBuffSize )
+        self._setNoDelay( self._sRead )
 
-        self.set_close_on_exec(self._sRead.fileno())
+        if not _sockTypeFlags:
+            self._sRead.setblocking(0)
+            self.set_close_on_exec(self._sRead.fileno())
 
         if self.AF_type == socket.AF_UNIX:
             self.removeUNIXFile(self._readAddress)
 
+        self._readAddress = _resolveAddress( self._readAddress, self.AF_type )
+
         self._sRead.bind( self._readAddress )
         self._rConnected = True
 
@@ -132,26 +250,72 @@ class mavSocket( commAbstract ):
             warnings.warn('Write address not yet known', UserWarning, stacklevel=3)
             return False
 
-        self._sWrite = socket.socket( self.AF_type, self.SOCK_type )
+        self._sWrite = socket.socket( self.AF_type, self.SOCK_type | _sockTypeFlags )
 
         if self.enable_broadcast:
             self._sWrite.setsockopt( socket.SOL_SOCKET, socket.SO_BROADCAST, 1 )
 
         self._sWrite.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
-        self._sWrite.setblocking(0)
+        self._setBuffSize( self._sWrite, socket.SO_SNDBUF, self.sndBuffSize )
+        self._setNoDelay( self._sWrite )
+
+        if not _sockTypeFlags:
+            self._sWrite.setblocking(0)
+            self.set_close_on_exec(self._sWrite.fileno())
 
-        self.set_close_on_exec(self._sWrite.fileno())
+        self._writeAddress = _resolveAddress( self._writeAddress, self.AF_type )
 
         self._sWrite.connect( self._writeAddress )
 
-        # Retrun read port can be deterimened after UDP connect
-        if self._readAddress is None and self.isUDP():
-            self._readAddress = self._sWrite.getsockname()
+        # send on a connected datagram socket is atomic per datagram in the
+        # kernel, so the Python-level write lock adds nothing even when
+        # thread_safe was requested
+        if self.isUDP():
+            self._writeLock = contextlib.nullcontext()
 
         self._wConnected = True
 
+        # Retrun read port can be deterimened after UDP connect. Bind it
+        # straight away so replies sent before our first read are not dropped
+        if self._readAddress is None and self.isUDP():
+            self._readAddress = self._sWrite.getsockname()
+            self._sharedReadAddr = True
+            self._openReadPort()
+
         return True
 
+    # --------------------------------------------------------------------------
+    # _setNoDelay
+    # Disable Nagle coalescing in TCP stream mode. MAVLink frames are tens of
+    # bytes so letting the kernel hold them for up to 40 ms is catastrophic
+    # for latency
+    # param sock - socket to configure
+    # return void
+    # --------------------------------------------------------------------------
+    def _setNoDelay( self, sock ):
+        if self.SOCK_type != socket.SOCK_STREAM or self.AF_type == socket.AF_UNIX:
+            return
+
+        sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+    # --------------------------------------------------------------------------
+    # _setBuffSize
+    # Request a kernel buffer size for a socket and warn if the kernel clamped
+    # it below what was asked for (raise net.core.rmem_max/wmem_max to fix)
+    # param sock - socket to configure
+    # param opt - SO_RCVBUF or SO_SNDBUF
+    # param size - requested buffer size in bytes
+    # return void
+    # --------------------------------------------------------------------------
+    def _setBuffSize( self, sock, opt, size ):
+        sock.setsockopt( socket.SOL_SOCKET, opt, size )
+
+        applied = sock.getsockopt( socket.SOL_SOCKET, opt )
+
+        if applied < size:
+            warnings.warn( 'Kernel clamped socket buffer to %d of %d bytes requested' %
+                           ( applied, size ), UserWarning, stacklevel=4 )
+
     # --------------------------------------------------------------------------
     # closePort
     # Close the socket connection port if it is open
@@ -163,20 +327,63 @@ class mavSocket( commAbstract ):
         self._closeWritePort()
 
     def _closeReadPort(self):
+        if self._sRead is None:
+            return
+
+        self._setLinger( self._sRead )
+
+        # Shut the socket down before closing so the peer is told immediately
+        # and the address is free for the next openPort. UDP sockets raise
+        # ENOTCONN here which is fine to ignore
+        try:
+            self._sRead.shutdown( socket.SHUT_RDWR )
+        except OSError:
+            pass
+
         try:
             self._sRead.close()
             self.removeUNIXFile(self._readAddress)
 
             self._rConnected = False
-        except:
-            traceback.print_exc(file=sys.stdout)
-    
+        except OSError:
+            self.errCounters['closeRead'] += 1
+            _log.warning( 'Read socket close failed', exc_info = True )
+
     def _closeWritePort(self):
+        if self._sWrite is None:
+            return
+
+        self._setLinger( self._sWrite )
+
+        try:
+            self._sWrite.shutdown( socket.SHUT_RDWR )
+        except OSError:
+            pass
+
         try:
             self._sWrite.close()
             self._wConnected = False
-        except:
-            traceback.print_exc(file=sys.stdout)
+        except OSError:
+            self.errCounters['closeWrite'] += 1
+            _log.warning( 'Write socket close failed', exc_info = True )
+
+    # --------------------------------------------------------------------------
+    # _setLinger
+    # Arm an abortive close when abortOnClose is set. SO_LINGER with a zero
+    # timeout makes close send an RST rather than lingering in TIME_WAIT.
+    # Only meaningful for stream sockets, datagram close is already immediate
+    # param sock - socket about to be closed
+    # return void
+    # --------------------------------------------------------------------------
+    def _setLinger( self, sock ):
+        if not self.abortOnClose or self.SOCK_type != socket.SOCK_STREAM:
+            return
+
+        try:
+            sock.setsockopt( socket.SOL_SOCKET, socket.SO_LINGER,
+                             struct.pack( 'ii', 1, 0 ) )
+        except OSError:
+            pass
 
     def removeUNIXFile(self, fileName):
         if self.AF_type == socket.AF_UNIX:
@@ -191,24 +398,119 @@ class mavSocket( commAbstract ):
     # return tuple of (data, (recieved address)) for each message in buffer
     # --------------------------------------------------------------------------
     def read( self, b = 0 ):
-        if not self._openReadPort():
+        if not self._rConnected and not self._openReadPort():
             return b''
 
-        self._readLock.acquire()
+        with self._readLock:
+            try:
+                n, addr = self._sRead.recvfrom_into( self._rxBuf, self.buffSize )
+                m = bytes( self._rxView[:n] )
+
+                if self._writeAddress is None:
+                    self._writeAddress = addr
+
+            except(socket.timeout, BlockingIOError):
+                m =  b''
+
+        return m
+
+    # --------------------------------------------------------------------------
+    # readAll
+    # Sockets receive a whole datagram per read so there is nothing further to
+    # batch, this is an alias for read
+    # param null
+    # return byte string of next datagram, b'' if none waiting
+    # --------------------------------------------------------------------------
+    def readAll( self ):
+        return self.read()
+
+    # --------------------------------------------------------------------------
+    # read_into_pooled
+    # Receive a datagram into a buffer taken from the freelist and return a
+    # memoryview over just the received bytes - no copy is made. The caller
+    # must hand the view back through release once it is done with the data
+    # param null
+    # return memoryview of next datagram, b'' if none waiting
+    # --------------------------------------------------------------------------
+    def read_into_pooled( self ):
+        if not self._rConnected and not self._openReadPort():
+            return b''
 
         try:
-            m, addr = self._sRead.recvfrom( self.buffSize )
+            buf = self._recvPool.popleft()
+        except IndexError:
+            buf = bytearray( self.buffSize )
 
-            if self._writeAddress is None:
-                self._writeAddress = addr
+        with self._readLock:
+            try:
+                n, addr = self._sRead.recvfrom_into( buf, self.buffSize )
 
-        except(socket.timeout, BlockingIOError):
-            m =  b''
+                if self._writeAddress is None:
+                    self._writeAddress = addr
 
-        finally:
-            self._readLock.release()
+            except( socket.timeout, BlockingIOError ):
+                n = 0
 
-        return m
+        if n == 0:
+            self._releaseBuf( buf )
+            return b''
+
+        return memoryview( buf )[:n]
+
+    # --------------------------------------------------------------------------
+    # read_batch
+    # Drain up to maxMsgs waiting datagrams in one call. CPython does not
+    # expose recvmmsg so this is a Python-level batch, but it still takes the
+    # read lock once and costs one method call for the whole batch rather
+    # than one per datagram. Views must be handed back through release
+    # param maxMsgs - maximum number of datagrams to return
+    # return list of memoryviews, empty if nothing is waiting
+    # --------------------------------------------------------------------------
+    def read_batch( self, maxMsgs = 32 ):
+        views = []
+
+        if not self._rConnected and not self._openReadPort():
+            return views
+
+        with self._readLock:
+            for _ in range( maxMsgs ):
+                try:
+                    buf = self._recvPool.popleft()
+                except IndexError:
+                    buf = bytearray( self.buffSize )
+
+                try:
+                    n, addr = self._sRead.recvfrom_into( buf, self.buffSize )
+
+                    if self._writeAddress is None:
+                        self._writeAddress = addr
+
+                except( socket.timeout, BlockingIOError ):
+                    n = 0
+
+                if n == 0:
+                    self._releaseBuf( buf )
+                    break
+
+                views.append( memoryview( buf )[:n] )
+
+        return views
+
+    # --------------------------------------------------------------------------
+    # release
+    # Return a view handed out by read_into_pooled to the freelist
+    # param view - memoryview previously returned by read_into_pooled
+    # return void
+    # --------------------------------------------------------------------------
+    def release( self, view ):
+        if isinstance( view, memoryview ):
+            buf = view.obj
+            view.release()
+            self._releaseBuf( buf )
+
+    def _releaseBuf( self, buf ):
+        if len( buf ) == self.buffSize and len( self._recvPool ) < self._recvPoolCap:
+            self._recvPool.append( buf )
 
     # --------------------------------------------------------------------------
     # write
@@ -218,19 +520,40 @@ class mavSocket( commAbstract ):
     # return raises an Exception if there is an error
     # --------------------------------------------------------------------------
     def write( self, b ):
-        if not self._openWritePort():
+        if not self._wConnected and not self._openWritePort():
             return
 
-        self._writeLock.acquire()
+        with self._writeLock:
+            try:
+                self._sWrite.send(b)
 
-        try:
-            self._sWrite.send(b)
-            
-        except Exception:
-            traceback.print_exc(file=sys.stdout)
+            except OSError:
+                self.errCounters['write'] += 1
 
-        finally:
-            self._writeLock.release()
+                if _log.isEnabledFor( logging.DEBUG ):
+                    _log.debug( 'Socket write failed', exc_info = True )
+
+    # --------------------------------------------------------------------------
+    # writeBatch
+    # Write several byte buffers with a single gather-I/O syscall. The buffers
+    # are sent back to back in one datagram, mavlink parsers split
+    # concatenated frames without issue
+    # param bufs - list of byte buffers to write
+    # return void
+    # --------------------------------------------------------------------------
+    def writeBatch( self, bufs ):
+        if not self._wConnected and not self._openWritePort():
+            return
+
+        with self._writeLock:
+            try:
+                self._sWrite.sendmsg( bufs )
+
+            except OSError:
+                self.errCounters['writeBatch'] += 1
+
+                if _log.isEnabledFor( logging.DEBUG ):
+                    _log.debug( 'Socket batch write failed', exc_info = True )
 
     # --------------------------------------------------------------------------
     # isOpen
@@ -250,24 +573,85 @@ class mavSocket( commAbstract ):
     def dataAvailable( self ):
         return False
 
+    # --------------------------------------------------------------------------
+    # fileno
+    # Expose the read socket's file descriptor so the port can be registered
+    # with an external event loop, e.g. asyncio loop.add_reader
+    # param null
+    # return file descriptor number, raises if the read socket is not open
+    # --------------------------------------------------------------------------
+    def fileno( self ):
+        if not self._rConnected:
+            raise OSError( 'Read socket not open' )
+
+        return self._sRead.fileno()
+
+    # --------------------------------------------------------------------------
+    # wait_readable
+    # Block until a datagram is waiting on the read socket or the timeout
+    # expires
+    # param timeout - maximum time to wait in seconds, None waits forever
+    # return True if data is available to read, False on timeout
+    # --------------------------------------------------------------------------
+    def wait_readable( self, timeout = None ):
+        if not self._rConnected:
+            # No read socket yet - fall back to a plain sleep so callers
+            # don't spin
+            if timeout is not None:
+                time.sleep( timeout )
+
+            return False
+
+        try:
+            return bool( select.select( [ self._sRead ], [], [], timeout )[0] )
+
+        except( OSError, ValueError ):
+            return False
+
     # --------------------------------------------------------------------------
     # flush
-    # Not possible to flush a socket connection so this is left blank
+    # Discard any datagrams waiting on the read socket. Each datagram is
+    # dropped in the kernel without copying its payload to userspace and the
+    # drain is bounded so a fast sender cannot hold us here forever
     # param null
     # return void
     # --------------------------------------------------------------------------
     def flush( self ):
-        # Probably need a limit to prevent an infinite loop
-        while self.read() != b'':
-            pass
+        if not self._openReadPort():
+            return
+
+        # MSG_TRUNC discards the payload without a userspace copy on Linux.
+        # The socket is nonblocking so an empty buffer surfaces as
+        # BlockingIOError - one syscall per discarded datagram, no select
+        # needed. Platforms that define MSG_TRUNC but reject it as a recv
+        # input flag get one EINVAL, after which the drain falls back to
+        # reading each datagram into the reusable receive buffer
+        flags = getattr( socket, 'MSG_TRUNC', 0 )
+
+        for _ in range( self._maxFlushPackets ):
+            try:
+                if flags:
+                    self._sRead.recv( 1, flags )
+                else:
+                    self._sRead.recvfrom_into( self._rxBuf, self.buffSize )
+
+            except BlockingIOError:
+                break
+
+            except OSError:
+                if not flags:
+                    break
+
+                flags = 0
 
     def set_close_on_exec(self, fd):
+        if fcntl is None:
+            return
+
         try:
-            import fcntl
             flags = fcntl.fcntl(fd, fcntl.F_GETFD)
-            flags |= fcntl.FD_CLOEXEC
-            fcntl.fcntl(fd, fcntl.F_SETFD, flags)
-        except:
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        except OSError:
             pass
 
 # ------------------------------------ EOF -------------------------------------
@@ -8,18 +8,21 @@
 # Author: Freddie Sherratt
 # ------------------------------------------------------------------------------
 
-import time
-import threading
+import collections
+import logging
+import os
+import selectors
 import traceback
 import abc
 import sys
 
-if sys.version_info.major == 3:
-    import queue
-else:
-    import Queue as queue
-
 from .commAbstract import commAbstract
+from .spscRing import spscPriorityRing
+
+# Silent unless the application configures logging, errors are also tallied
+# in errCounters so hot paths never pay for formatted I/O
+_log = logging.getLogger( __name__ )
+_log.addHandler( logging.NullHandler() )
 
 # ------------------------------------------------------------------------------
 # MAVAbstract
@@ -55,11 +58,35 @@ class mavThread:
 
         self._mavLib = mavLib
 
+        # Cached so the per-enqueue type check skips the mavLib attribute
+        # lookup
+        self._msgType = mavLib.MAVLink_message
+
         self.loopPauseSleepTime = 0.5
         self.noRWSleepTime = 0.1
-        self._seq = 0
+        self.maxWriteBatch = 16
+
+        self._writeQueue = spscPriorityRing()
+
+        # Tally of swallowed errors per operation, inspect this rather than
+        # expecting parse errors on stdout
+        self.errCounters = collections.Counter()
+
+        # Wake pipe lets queueOutputMsg rouse the loop the moment a message
+        # is queued instead of waiting out the idle sleep. POSIX only - on
+        # Windows the select based selector rejects non-socket fds, so the
+        # idle branch waits on the comm port alone there
+        if os.name == 'posix':
+            self._wakeR, self._wakeW = os.pipe()
+            os.set_blocking( self._wakeR, False )
+            os.set_blocking( self._wakeW, False )
+        else:
+            self._wakeR = None
+            self._wakeW = None
 
-        self._writeQueue = queue.PriorityQueue()
+        self._selector = None
+        self._serFd = None
+        self._cpuAffinity = None
 
         self._intentionallyExit = False
         
@@ -96,6 +123,18 @@ class mavThread:
     def srcComponent(self, cmpid):
         self._mavObj.srcComponent = cmpid
 
+    # --------------------------------------------------------------------------
+    # set_cpu_affinity
+    # Pin the loop thread to a single CPU so packet data stays in that core's
+    # cache. For best results steer the NIC's RX interrupt for this flow to
+    # the same core (RPS, /sys/class/net/*/queues/rx-*/rps_cpus). Call before
+    # starting the loop. Only effective on platforms with sched_setaffinity
+    # param cpu - CPU index to pin to, None leaves scheduling to the OS
+    # return void
+    # --------------------------------------------------------------------------
+    def set_cpu_affinity( self, cpu ):
+        self._cpuAffinity = cpu
+
     # --------------------------------------------------------------------------
     # stopRWLoop
     # Stops the serial R/W loop by setting _intentionallyExit to True. Stopping 
@@ -106,21 +145,64 @@ class mavThread:
     def stopLoop( self ):
         self._intentionallyExit = True
 
+    # --------------------------------------------------------------------------
+    # close
+    # Release the wake pipe and selector once the loop is no longer needed.
+    # stopLoop only sets a flag, so join the loop thread (or wait on your own
+    # stopped event) before calling - a wait already in progress when close
+    # runs ends early but harmlessly. Safe to call more than once. The comm
+    # port is left open, closing it remains the owner's job
+    # param null
+    # return void
+    # --------------------------------------------------------------------------
+    def close( self ):
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+            self._serFd = None
+
+        if self._wakeR is not None:
+            try:
+                os.close( self._wakeR )
+                os.close( self._wakeW )
+            except OSError:
+                pass
+
+            self._wakeR = None
+            self._wakeW = None
+
+    def __del__( self ):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     # --------------------------------------------------------------------------
     # queueOutputMsg
     # Add mavlink messages to writing queue, does not accept messages when
-    # RW loop is paused.
+    # RW loop is paused. The queue is bounded per priority level - unlike the
+    # old unbounded PriorityQueue, a full level returns False and the message
+    # is dropped, so callers that must not lose messages should check the
+    # return value
     # param: msg - mavlink message to add to the queue
     # param: priority - message priority, specify priority of message. A higher
     # number gives a higher priority. (default 5)
-    # return: boolean True if successful, false otherwise, exception if an error
+    # return: boolean True if queued, False if not a mavlink message or the
+    # priority level is full
     # --------------------------------------------------------------------------
     def queueOutputMsg( self, msg, priority = 5 ):
-        if not isinstance( msg, self._mavLib.MAVLink_message ):
+        if not isinstance( msg, self._msgType ):
            return False
 
-        self._writeQueue.put( (priority, self._seq, msg) )
-        self._seq += 1
+        if not self._writeQueue.put( msg, priority ):
+            return False
+
+        if self._wakeW is not None:
+            try:
+                os.write( self._wakeW, b'x' )
+            except OSError:
+                # Pipe full means a wake-up is already pending
+                pass
 
         return True
 
@@ -135,6 +217,9 @@ class mavThread:
     def loop(self):
         self._intentionallyExit = False
 
+        if self._cpuAffinity is not None and hasattr( os, 'sched_setaffinity' ):
+            os.sched_setaffinity( 0, { self._cpuAffinity } )
+
         if not self._ser.isOpen():
             self._ser.openPort()
 
@@ -160,17 +245,84 @@ class mavThread:
 
     def _loopInternals( self ):
         rMsg = self._readMsg()
-        wMsg = self._getWriteMsg()
 
-        if rMsg is None and wMsg is None:
-            time.sleep( self.noRWSleepTime)
+        # Drain up to maxWriteBatch pending messages so they go out in a
+        # single batched write
+        wMsgList = []
+
+        while len( wMsgList ) < self.maxWriteBatch:
+            wMsg = self._getWriteMsg()
+
+            if wMsg is None:
+                break
+
+            wMsgList.append( wMsg )
+
+        if not rMsg and not wMsgList:
+            # Wake early if data arrives or a message is queued rather than
+            # sleeping the full period
+            self._waitForEvent( self.noRWSleepTime )
             return
 
-        if rMsg is not None:
+        if rMsg:
             self._processReadMsg(rMsg)
 
-        if wMsg is not None:
-            self._writeMsg(wMsg)
+        if wMsgList:
+            self._writeMsg(wMsgList)
+
+    # --------------------------------------------------------------------------
+    # _waitForEvent
+    # Block until the comm port is readable, a message is queued through the
+    # wake pipe, or the timeout expires. The comm port registration is kept
+    # in step with its current fd so a closePort/openPort reconnect does not
+    # leave the selector watching a stale descriptor
+    # param timeout - maximum time to wait in seconds
+    # return void
+    # --------------------------------------------------------------------------
+    def _waitForEvent( self, timeout ):
+        if self._wakeR is None:
+            # No wake pipe on this platform, wait on the comm port alone -
+            # queued messages are picked up once the timeout expires
+            self._ser.wait_readable( timeout )
+            return
+
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register( self._wakeR, selectors.EVENT_READ )
+
+        try:
+            fd = self._ser.fileno()
+        except( OSError, ValueError ):
+            fd = None
+
+        if fd != self._serFd:
+            if self._serFd is not None:
+                try:
+                    self._selector.unregister( self._serFd )
+                except KeyError:
+                    pass
+
+            if fd is not None:
+                try:
+                    self._selector.register( fd, selectors.EVENT_READ )
+                except( OSError, ValueError ):
+                    fd = None
+
+            self._serFd = fd
+
+        try:
+            events = self._selector.select( timeout )
+        except( OSError, ValueError, AttributeError ):
+            # close() ran concurrently and pulled the selector out from
+            # under the wait, the loop is shutting down
+            return
+
+        for key, _ in events:
+            if key.fd == self._wakeR:
+                try:
+                    os.read( self._wakeR, 4096 )
+                except OSError:
+                    pass
 
     # --------------------------------------------------------------------------
     # _processReadMsg
@@ -187,44 +339,45 @@ class mavThread:
     # _getWriteMsg
     # Returns the next item in the writing message queue
     # param null
-    # return - MAVLink_message object from queue, None if queue empty,
-    # Exception if an error occurs
+    # return - MAVLink_message object from queue, None if queue empty
     # --------------------------------------------------------------------------
     def _getWriteMsg(self):
-        try:
-            msg = self._writeQueue.get_nowait()
-            return msg[2]
-        except queue.Empty:
-            return None
+        return self._writeQueue.get()
 
     # --------------------------------------------------------------------------
     # _writeMsg
-    # Writes mavlink messages out as a bit stream on port associated with class
-    # param msg - message to write out
-    # return - True if msg written, Exception if an error occurs,
+    # Writes queued mavlink messages out as a bit stream on port associated
+    # with class. All messages in the list are packed and sent with a single
+    # batched write, the buffer pack allocates is handed straight to the port
+    # param msgList - list of messages to write out
+    # return - True if messages written, Exception if an error occurs,
     # False otherwise
     # --------------------------------------------------------------------------
-    def _writeMsg( self, msg ):
-        if msg is None:
+    def _writeMsg( self, msgList ):
+        if not msgList:
             return False
 
-        try:
-            msg.pack( self._mavObj )
-            b = msg.get_msgbuf()
+        # Pack each message under its own guard so one bad message only
+        # loses itself, the rest of the batch still goes out
+        parts = []
 
-            self._ser.write( b )
+        for msg in msgList:
+            try:
+                msg.pack( self._mavObj )
+                parts.append( msg.get_msgbuf() )
 
-            self._writeQueue.task_done()
+            except self._mavLib.MAVError:
+                self.errCounters['pack'] += 1
 
-            return True
+                if _log.isEnabledFor( logging.DEBUG ):
+                    _log.debug( 'Message pack failed', exc_info = True )
 
-        except queue.Empty:
-            pass
+        if not parts:
+            return False
 
-        except self._mavLib.MAVError as e:
-            print(e)
+        self._ser.writeBatch( parts )
 
-        return False
+        return True
 
     # --------------------------------------------------------------------------
     # _readMsg
@@ -237,18 +390,29 @@ class mavThread:
         mList = []
 
         while True:
-            try:
-                x = self._ser.read()
-                if x == b'':
-                    break
+            batch = self._ser.read_batch()
 
-                msg = self._mavObj.parse_buffer(x)
+            if not batch:
+                break
 
-                if msg is not None:
-                    mList.extend( msg )
-                
-            except self._mavLib.MAVError as e:
-                print(e)
+            for x in batch:
+                try:
+                    # parse_buffer copies the bytes into its own accumulator
+                    # so the pooled buffer can be released as soon as it
+                    # returns
+                    try:
+                        msg = self._mavObj.parse_buffer(x)
+                    finally:
+                        self._ser.release(x)
+
+                    if msg is not None:
+                        mList.extend( msg )
+
+                except self._mavLib.MAVError:
+                    self.errCounters['parse'] += 1
+
+                    if _log.isEnabledFor( logging.DEBUG ):
+                        _log.debug( 'Message parse failed', exc_info = True )
 
         return mList
 
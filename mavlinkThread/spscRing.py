@@ -0,0 +1,127 @@
+# ------------------------------------------------------------------------------
+# spscRing.py
+# Fixed-size ring buffers for the mavThread write queue. spscRing is strictly
+# single-producer/single-consumer - each side only writes its own index, so
+# under the GIL neither path needs a lock. spscPriorityRing keeps the
+# multi-producer contract of the queue.PriorityQueue it replaced by taking a
+# lock on put only, the consumer side stays lock-free - unlike PriorityQueue
+# which takes a mutex and fixes up a heap per operation on both sides
+#
+# Author: Freddie Sherratt
+# ------------------------------------------------------------------------------
+
+import threading
+
+class spscRing:
+    # --------------------------------------------------------------------------
+    # __init__
+    # initialise ring, capacity is rounded up to the next power of two so the
+    # index wrap is a mask rather than a modulo
+    # param size - minimum number of slots
+    # return void
+    # --------------------------------------------------------------------------
+    def __init__( self, size = 256 ):
+        n = 1
+        while n < size:
+            n <<= 1
+
+        self._mask = n - 1
+        self._buf = [ None ] * n
+
+        # Monotonic indices, only the producer advances _tail and only the
+        # consumer advances _head
+        self._head = 0
+        self._tail = 0
+
+    # --------------------------------------------------------------------------
+    # put
+    # Producer side, append an item to the ring
+    # param item - object to enqueue
+    # return True if enqueued, False if the ring is full
+    # --------------------------------------------------------------------------
+    def put( self, item ):
+        if self._tail - self._head > self._mask:
+            return False
+
+        self._buf[ self._tail & self._mask ] = item
+        self._tail += 1
+
+        return True
+
+    # --------------------------------------------------------------------------
+    # get
+    # Consumer side, remove and return the oldest item
+    # param null
+    # return queued item, None if the ring is empty
+    # --------------------------------------------------------------------------
+    def get( self ):
+        if self._head == self._tail:
+            return None
+
+        idx = self._head & self._mask
+
+        item = self._buf[ idx ]
+        self._buf[ idx ] = None
+
+        self._head += 1
+
+        return item
+
+    def __len__( self ):
+        return self._tail - self._head
+
+
+class spscPriorityRing:
+    # --------------------------------------------------------------------------
+    # __init__
+    # initialise priority ring set. One spscRing is kept per priority level so
+    # priority ordering costs no heap fixup, the consumer just drains the
+    # most urgent (lowest numbered) ring first
+    # param size - number of slots per priority level
+    # return void
+    # --------------------------------------------------------------------------
+    def __init__( self, size = 256 ):
+        self._size = size
+        self._rings = {}
+
+        # put is callable from any thread - the tail advance in spscRing and
+        # the lazy per-priority ring insert are both read-modify-writes that
+        # two producers could interleave, losing messages
+        self._putLock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # put
+    # Producer side, enqueue an item at the given priority level. Safe to
+    # call from multiple threads
+    # param item - object to enqueue
+    # param priority - priority level, a lower number is drained sooner
+    # return True if enqueued, False if that priority level is full
+    # --------------------------------------------------------------------------
+    def put( self, item, priority = 5 ):
+        with self._putLock:
+            try:
+                ring = self._rings[ priority ]
+            except KeyError:
+                ring = self._rings[ priority ] = spscRing( self._size )
+
+            return ring.put( item )
+
+    # --------------------------------------------------------------------------
+    # get
+    # Consumer side, remove and return the most urgent queued item
+    # param null
+    # return queued item, None if all rings are empty
+    # --------------------------------------------------------------------------
+    def get( self ):
+        for priority in sorted( self._rings ):
+            item = self._rings[ priority ].get()
+
+            if item is not None:
+                return item
+
+        return None
+
+    def __len__( self ):
+        return sum( len( r ) for r in self._rings.values() )
+
+# ------------------------------------ EOF -------------------------------------
@@ -0,0 +1,17 @@
+import os
+import socket
+import sys
+
+# Make the repository root importable once per session instead of each test
+# file appending the current working directory to sys.path. insert(0) keeps
+# the lookup at the front so imports don't scan the whole path list
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+def _freePort():
+    # Ask the OS for an unused UDP port so concurrent test runs don't collide
+    s = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+    s.bind( ('', 0) )
+    port = s.getsockname()[1]
+    s.close()
+
+    return port
@@ -0,0 +1,56 @@
+import pytest
+
+# Round trip benchmarks, run with pytest --benchmark-only. The module is
+# skipped when pytest-benchmark is not installed so the correctness suite
+# carries no extra dependency
+pytest.importorskip('pytest_benchmark')
+
+from threading import Thread
+
+from conftest import _freePort
+from test_mavThread import testMavlinkThread, _TEST_DEBUG_MSG, _TEST_PING_MSG
+
+from mavlinkThread import mavSocket
+import pymavlink.dialects.v20.ardupilotmega as pymavlink
+
+
+@pytest.fixture(scope='module')
+def mav():
+    # One running loop shared by every benchmark so thread and import setup
+    # is paid once and the timed region is just the message round trip
+    testAddress = ('localhost', _freePort())
+
+    comm = mavSocket.mavSocket( testAddress, testAddress )
+    comm.openPort()
+
+    m = testMavlinkThread(comm, pymavlink)
+
+    mt = Thread(target = m.loop)
+    mt.daemon = True
+    mt.start()
+
+    yield m
+
+    m.stopLoop()
+    m.stopped.wait(1.0)
+    comm.closePort()
+
+
+@pytest.mark.benchmark(group='mav-roundtrip')
+def test_readRoundTrip(benchmark, mav):
+    def roundTrip():
+        mav.queueOutputMsg( _TEST_DEBUG_MSG )
+        return mav.getReadMsg()
+
+    benchmark(roundTrip)
+
+
+@pytest.mark.benchmark(group='mav-roundtrip')
+def test_priorityRoundTrip(benchmark, mav):
+    def roundTrip():
+        mav.queueOutputMsg( _TEST_DEBUG_MSG, priority = 5 )
+        mav.queueOutputMsg( _TEST_PING_MSG, priority = 1 )
+
+        return mav.getReadMsg(), mav.getReadMsg()
+
+    benchmark(roundTrip)
@@ -1,17 +1,16 @@
 import unittest
 import socket
-import time
 import os
-import sys
-
-sys.path.append(os.path.abspath(''))
+import shutil
+import tempfile
 
+from conftest import _freePort
 from mavlinkThread.mavSocket import mavSocket as commObj
 
 class Test_SocketObjectCreation(unittest.TestCase):
     def setUp(self):
         # Setup reflective port - written data appears on read port
-        self.testAddressA = ('localhost', 10000)
+        self.testAddressA = ('localhost', _freePort())
 
         return super().setUp()
 
@@ -30,22 +29,32 @@ class Test_SocketObjectCreation(unittest.TestCase):
 
 
 class Test_ReflectiveSocketObject(unittest.TestCase):
-    def setUp(self):
-        # Setup reflective port - written data appears on read port
-        self.testAddressA = ('localhost', 10000)
+    @classmethod
+    def setUpClass(cls):
+        # Setup reflective port - written data appears on read port. The
+        # object is shared across tests, each test opens the port itself
+        cls.testAddressA = ('localhost', _freePort())
 
-        self.testAddressB = self.testAddressA
+        cls.testAddressB = cls.testAddressA
 
-        self.comm = commObj( self.testAddressA, self.testAddressB )
+        cls.comm = commObj( cls.testAddressA, cls.testAddressB )
 
-        self.testBytes = b'Hello, World!'
+        cls.testBytes = b'Hello, World!'
 
-        return super().setUp()
+        return super().setUpClass()
 
-    def tearDown(self):
-        self.comm.closePort()
-        
-        return super().tearDown()
+    @classmethod
+    def tearDownClass(cls):
+        cls.comm.closePort()
+
+        return super().tearDownClass()
+
+    def setUp(self):
+        # Discard anything a previous test left in the loopback buffer
+        if self.comm.isOpen():
+            self.comm.flush()
+
+        return super().setUp()
 
     def test_Connected(self):
         # Connected state occurs if both read and write addresses are given
@@ -65,7 +74,7 @@ class Test_ReflectiveSocketObject(unittest.TestCase):
         self.comm.openPort()
 
         self.comm.write( self.testBytes )
-        time.sleep(0.01)
+        self.comm.wait_readable(0.5)
         bytesIn = self.comm.read()
 
         self.assertEqual(self.testBytes, bytesIn)
@@ -74,8 +83,8 @@ class Test_ReflectiveSocketObject(unittest.TestCase):
         # Test flush operation clears read in buffer
         self.comm.openPort()
         self.comm.write( self.testBytes )
-        
-        time.sleep(0.01)
+
+        self.comm.wait_readable(0.5)
 
         self.comm.flush()
         bytesIn = self.comm.read()
@@ -85,7 +94,7 @@ class Test_ReflectiveSocketObject(unittest.TestCase):
 class Test_DualSocketConnection(unittest.TestCase):
     def setUp(self):
         # Setup dual port - pointing at each other
-        self.testAddressA = ('127.0.0.1', 10000)
+        self.testAddressA = ('127.0.0.1', _freePort())
 
         self.testBytes = b'Hello, World!'
 
@@ -112,7 +121,7 @@ class Test_DualSocketConnection(unittest.TestCase):
     def test_readIn2(self):
         # Test data is read in correctly
         self.commA.write(self.testBytes)
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
         bytesIn = self.commB.read()
 
         self.assertEqual(self.testBytes, bytesIn)
@@ -120,7 +129,7 @@ class Test_DualSocketConnection(unittest.TestCase):
     def test_notconnected3(self):
         # CommB should not connect until is recieves a message from A and tries to write back
         self.commA.write(self.testBytes)
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
         self.commB.read()
 
         self.assertFalse(self.commB.isOpen())
@@ -128,7 +137,7 @@ class Test_DualSocketConnection(unittest.TestCase):
     def test_connected2(self):
         # CommB should not connect until is recieves a message from A and tries to write back
         self.commA.write(self.testBytes)
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
         self.commB.read()
         self.commB.write(self.testBytes)
 
@@ -136,15 +145,15 @@ class Test_DualSocketConnection(unittest.TestCase):
 
     def test_addressDiscovery(self):
         # Test that commB can respond to commA after learning address
+        # The discovered read port is bound as soon as the write port opens
+        # so no priming read is needed before B's reply arrives
         self.commA.write(self.testBytes)
-        # To bind to a discovered read port a read command must be sent
-        self.commA.read()
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
 
         # Discover connection and respond
         self.commB.read()
         self.commB.write(self.testBytes)
-        time.sleep(0.01)
+        self.commA.wait_readable(0.5)
 
         # Read in data
         bytesIn = self.commA.read()
@@ -152,31 +161,47 @@ class Test_DualSocketConnection(unittest.TestCase):
         self.assertEqual(self.testBytes, bytesIn)
 
 
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'no AF_UNIX')
 class Test_AF_UNIX(unittest.TestCase):
-    def setUp(self):
-        # Setup dual port - pointing at each other
-        self.testAddressA = os.path.abspath('') + '/.testA'
-        self.testAddressB = os.path.abspath('') + '/.testB'
+    @classmethod
+    def setUpClass(cls):
+        # Setup dual port - pointing at each other. Shared across tests,
+        # none of which opens commB's write side so its state stays fresh.
+        # Socket files live in a private temp dir, usually tmpfs backed,
+        # rather than littering the working directory
+        cls._tmpDir = tempfile.mkdtemp()
 
-        self.testBytes = b'Hello, World!'
+        cls.testAddressA = os.path.join( cls._tmpDir, '.testA' )
+        cls.testAddressB = os.path.join( cls._tmpDir, '.testB' )
+
+        cls.testBytes = b'Hello, World!'
 
         # B should discover boradcast address from A
-        self.commB = commObj( listenAddress=self.testAddressA, broadcastAddress=self.testAddressB )
-        self.commB.set_AF_type( socket.AF_UNIX )
-        self.commB.openPort()
+        cls.commB = commObj( listenAddress=cls.testAddressA, broadcastAddress=cls.testAddressB )
+        cls.commB.set_AF_type( socket.AF_UNIX )
+        cls.commB.openPort()
 
         # A should discover listen address from itself
-        self.commA = commObj( broadcastAddress=self.testAddressA, listenAddress=self.testAddressB )
-        self.commA.set_AF_type( socket.AF_UNIX )
-        self.commA.openPort()
+        cls.commA = commObj( broadcastAddress=cls.testAddressA, listenAddress=cls.testAddressB )
+        cls.commA.set_AF_type( socket.AF_UNIX )
+        cls.commA.openPort()
 
-        return super().setUp()
+        return super().setUpClass()
 
-    def tearDown(self):
-        self.commA.closePort()
-        self.commB.closePort()
+    @classmethod
+    def tearDownClass(cls):
+        cls.commA.closePort()
+        cls.commB.closePort()
 
-        return super().tearDown()
+        shutil.rmtree( cls._tmpDir, ignore_errors=True )
+
+        return super().tearDownClass()
+
+    def setUp(self):
+        # Discard anything a previous test left undelivered
+        self.commB.flush()
+
+        return super().setUp()
 
     def test_notConnected2(self):
         # CommB should not connect until is recieves a message from A and tries to respond
@@ -185,7 +210,7 @@ class Test_AF_UNIX(unittest.TestCase):
     def test_readIn2(self):
         # Test data is read in correctly
         self.commA.write(self.testBytes)
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
         bytesIn = self.commB.read()
 
         self.assertEqual(self.testBytes, bytesIn)
@@ -193,7 +218,7 @@ class Test_AF_UNIX(unittest.TestCase):
     def test_notconnected3(self):
         # CommB should not connect until is recieves a message from A and tries to write back
         self.commA.write(self.testBytes)
-        time.sleep(0.01)
+        self.commB.wait_readable(0.5)
         self.commB.read()
 
         self.assertFalse(self.commB.isOpen())
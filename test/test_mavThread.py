@@ -1,29 +1,84 @@
 import unittest
-import serial
 import time
-from threading import Thread
+import collections
+from threading import Thread, Event
 import queue
 
+from conftest import _freePort
 from mavlinkThread import mavSocket, mavThread
 import pymavlink.dialects.v20.ardupilotmega as pymavlink
 
+# Payloads are only used for type assertions so one instance per module is
+# enough - pymavlink constructors are surprisingly heavy
+_TEST_DEBUG_MSG = pymavlink.MAVLink_debug_message(0, 1, 2)
+_TEST_PING_MSG = pymavlink.MAVLink_ping_message(0, 0, 0, 0)
+
 class testMavlinkThread(mavThread.mavThread):
     def __init__(self, conn, mavLib):
-        self.readQueue = queue.Queue()
+        # Single producer (the loop) and single consumer (the test), so a
+        # plain deque plus an Event beats queue.Queue's per-op locking
+        self.readQueue = collections.deque()
+        self._msgEvent = Event()
+
+        # Set when the loop actually starts and stops so tests can wait on
+        # real state changes rather than sleeping
+        self.started = Event()
+        self.stopped = Event()
+
+        # Gate honoured between loop iterations so one daemon thread can be
+        # parked and reused across tests instead of created per test
+        self.pauseGate = Event()
+        self.pauseGate.set()
+        self.parked = Event()
 
         super( testMavlinkThread, self).__init__( conn, mavLib )
 
+    def loop(self):
+        self.started.set()
+
+        try:
+            super( testMavlinkThread, self).loop()
+        finally:
+            self.stopped.set()
+
+    def _loopInternals(self):
+        if not self.pauseGate.is_set():
+            self.parked.set()
+            self.pauseGate.wait( self.loopPauseSleepTime )
+            return
+
+        self.parked.clear()
+
+        super( testMavlinkThread, self)._loopInternals()
+
     def _processReadMsg(self, msgList):
         for msg in msgList:
-            self.readQueue.put(msg)
+            self.readQueue.append(msg)
+
+        if msgList:
+            self._msgEvent.set()
 
     def getReadMsg(self) -> pymavlink.MAVLink_message:
-        return self.readQueue.get(timeout=1)
+        deadline = time.monotonic() + 1
+
+        while True:
+            try:
+                return self.readQueue.popleft()
+            except IndexError:
+                pass
+
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                raise queue.Empty
+
+            self._msgEvent.wait(remaining)
+            self._msgEvent.clear()
 
 
 class Test_ObjectCreation(unittest.TestCase):
     def setUp(self):
-        self.testAddress = ('localhost', 10000)
+        self.testAddress = ('localhost', _freePort())
 
         self.comm = mavSocket.mavSocket( self.testAddress, self.testAddress )
         self.comm.openPort()
@@ -49,9 +104,7 @@ class Test_ObjectCreation(unittest.TestCase):
         mt.daemon = True
         mt.start()
 
-        time.sleep(0.5)
-
-        self.assertTrue(mt.isAlive())
+        self.assertTrue(mav.started.wait(0.5))
 
     def test_mavLoopStop(self):
         mav = testMavlinkThread(self.comm, pymavlink)
@@ -60,45 +113,65 @@ class Test_ObjectCreation(unittest.TestCase):
         mt.daemon = True
         mt.start()
 
+        self.assertTrue(mav.started.wait(0.5))
+
         mav.stopLoop()
-        time.sleep(1)
 
-        self.assertFalse(mt.isAlive())
+        self.assertTrue(mav.stopped.wait(1.0))
 
 
 class Test_Functionality(unittest.TestCase):
-    def setUp(self):
-        self.testAddress = ('localhost', 10000)
+    @classmethod
+    def setUpClass(cls):
+        # One loop thread for the whole class, started parked. Tests resume
+        # it through the pause gate where they previously called mt.start()
+        cls.testAddress = ('localhost', _freePort())
 
-        self.comm = mavSocket.mavSocket( self.testAddress, self.testAddress )
-        self.comm.openPort()
+        cls.comm = mavSocket.mavSocket( cls.testAddress, cls.testAddress )
+        cls.comm.openPort()
 
-        self.mav = testMavlinkThread(self.comm, pymavlink)
+        cls.mav = testMavlinkThread(cls.comm, pymavlink)
+        cls.mav.pauseGate.clear()
 
-        self.mt = Thread(target = self.mav.loop)
-        self.mt.daemon = True
+        cls.mt = Thread(target = cls.mav.loop)
+        cls.mt.daemon = True
+        cls.mt.start()
 
-        self.testMessage = pymavlink.MAVLink_debug_message(0,1,2)
-        self.testMessage2 = pymavlink.MAVLink_ping_message(0,0,0,0)
+        cls.testMessage = _TEST_DEBUG_MSG
+        cls.testMessage2 = _TEST_PING_MSG
 
-        return super().setUp()
+        return super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mav.stopLoop()
+        cls.mav.pauseGate.set()
+        cls.mav.stopped.wait(1.0)
+        cls.comm.closePort()
+
+        return super().tearDownClass()
 
     def tearDown(self):
-        self.mav.stopLoop()
-        self.comm.closePort()
-        
+        # Park the loop and discard anything this test left behind so the
+        # next test starts from a clean, paused state
+        self.mav.pauseGate.clear()
+        self.mav.parked.wait(1.0)
+
+        self.mav.readQueue.clear()
+        self.mav._msgEvent.clear()
+        self.comm.flush()
+
         return super().tearDown()
 
     def test_queueMessage(self):
-        self.mt.start()
+        self.mav.pauseGate.set()
         self.mav.queueOutputMsg( self.testMessage )
 
         self.assertTrue(True)
 
     def test_readMessage(self):
-        self.mt.start()
+        self.mav.pauseGate.set()
         self.mav.queueOutputMsg( self.testMessage )
-        time.sleep(1)
         msg = self.mav.getReadMsg()
 
         self.assertIsInstance( msg, type(self.testMessage) )
@@ -107,7 +180,7 @@ class Test_Functionality(unittest.TestCase):
         self.mav.queueOutputMsg( self.testMessage, priority = 5 )
         self.mav.queueOutputMsg( self.testMessage2, priority = 1 )
 
-        self.mt.start()
+        self.mav.pauseGate.set()
 
         msg1 = self.mav.getReadMsg()
         msg2 = self.mav.getReadMsg()
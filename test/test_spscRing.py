@@ -0,0 +1,85 @@
+import unittest
+
+from mavlinkThread.spscRing import spscRing, spscPriorityRing
+
+
+class Test_spscRing(unittest.TestCase):
+    def test_emptyGet(self):
+        ring = spscRing( 8 )
+
+        self.assertIsNone( ring.get() )
+        self.assertEqual( len( ring ), 0 )
+
+    def test_fifoOrder(self):
+        ring = spscRing( 8 )
+
+        for i in range( 5 ):
+            self.assertTrue( ring.put( i ) )
+
+        self.assertEqual( [ ring.get() for _ in range( 5 ) ], list( range( 5 ) ) )
+        self.assertIsNone( ring.get() )
+
+    def test_fullRejection(self):
+        # Capacity rounds up to a power of two, the next put must refuse
+        # rather than overwrite
+        ring = spscRing( 4 )
+
+        for i in range( 4 ):
+            self.assertTrue( ring.put( i ) )
+
+        self.assertFalse( ring.put( 99 ) )
+        self.assertEqual( len( ring ), 4 )
+
+        # Draining one slot makes room again
+        self.assertEqual( ring.get(), 0 )
+        self.assertTrue( ring.put( 99 ) )
+
+    def test_indexWraparound(self):
+        # Push the monotonic indices far past the capacity so the mask wrap
+        # is exercised many times over
+        ring = spscRing( 4 )
+
+        for i in range( 1000 ):
+            self.assertTrue( ring.put( i ) )
+            self.assertEqual( ring.get(), i )
+
+        self.assertEqual( len( ring ), 0 )
+
+
+class Test_spscPriorityRing(unittest.TestCase):
+    def test_priorityDrainOrder(self):
+        # Lower numbered priorities drain first regardless of insert order
+        queue = spscPriorityRing( 8 )
+
+        queue.put( 'low', priority = 5 )
+        queue.put( 'high', priority = 1 )
+        queue.put( 'mid', priority = 3 )
+
+        self.assertEqual( [ queue.get() for _ in range( 3 ) ],
+                          [ 'high', 'mid', 'low' ] )
+        self.assertIsNone( queue.get() )
+
+    def test_fifoWithinPriority(self):
+        queue = spscPriorityRing( 8 )
+
+        for i in range( 5 ):
+            self.assertTrue( queue.put( i, priority = 2 ) )
+
+        self.assertEqual( [ queue.get() for _ in range( 5 ) ], list( range( 5 ) ) )
+
+    def test_fullLevelRejection(self):
+        # A full priority level refuses further puts but leaves the other
+        # levels unaffected
+        queue = spscPriorityRing( 4 )
+
+        for i in range( 4 ):
+            self.assertTrue( queue.put( i, priority = 2 ) )
+
+        self.assertFalse( queue.put( 99, priority = 2 ) )
+        self.assertTrue( queue.put( 99, priority = 3 ) )
+
+        self.assertEqual( len( queue ), 5 )
+
+
+if __name__ == '__main__':
+    unittest.main()